@@ -1,10 +1,20 @@
 import os
+import functools
+import gzip
+import hashlib
+import queue
+import re
+import shutil
 import subprocess
+import threading
 import time
 import git
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import psutil
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -15,7 +25,21 @@ ROOT_PROJECT = os.environ.get("ROOT_PROJECT", "/home/arkiven4/Documents/Project/
 AUTOWATCH_ENV = os.environ.get("AUTOWATCH_ENV", "dev")
 
 FETCH_INTERVAL = 60 if AUTOWATCH_ENV == "dev" else 300 # 1 minute for dev, 5 minutes for prod
+# Each check without a new commit doubles a repo's interval, up to FETCH_INTERVAL * MAX_FETCH_INTERVAL_FACTOR
+MAX_FETCH_INTERVAL_FACTOR = 10
+# Bounds remote git operations so a hung remote cannot hold a fetch worker (or the
+# exit of the interpreter, which joins the workers). HTTP transfers slower than
+# 1 KiB/s for this many seconds are aborted by git itself on every platform, this
+# also applies to pulls. On POSIX an ls-remote still running after it is also
+# killed, GitPython does not support kill_after_timeout on Windows.
+REMOTE_QUERY_TIMEOUT = 60
+_GIT_LOW_SPEED_ENV = {"GIT_HTTP_LOW_SPEED_LIMIT": "1000", "GIT_HTTP_LOW_SPEED_TIME": str(REMOTE_QUERY_TIMEOUT)}
+_REMOTE_QUERY_KWARGS = {"env": _GIT_LOW_SPEED_ENV}
+if os.name != 'nt':
+    _REMOTE_QUERY_KWARGS["kill_after_timeout"] = REMOTE_QUERY_TIMEOUT
 
+# A project may set "exec_argv" (e.g. ["python", "-u", "run_cbm.py"]) to run the command
+# directly from repo_path instead of going through the script_to_run shell wrapper.
 PROJECTS = [
     {
         "name": "cbm_vale_cbm",
@@ -65,27 +89,144 @@ PROJECTS = [
 
 GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN")
 LOG_DIR = os.path.join(os.path.dirname(__file__), "logs")
-if not os.path.exists(LOG_DIR):
-    os.makedirs(LOG_DIR)
+os.makedirs(LOG_DIR, exist_ok=True)
+
+# Failure logs keep the last OUTPUT_TAIL_BYTES of a process' output, the issue
+# body only the last ISSUE_OUTPUT_CHARS of each stream since GitHub caps its size.
+OUTPUT_TAIL_BYTES = 1024 * 1024
+ISSUE_OUTPUT_CHARS = 30000
+
+# Issue logs untouched for LOG_COMPRESS_AGE seconds are gzipped by a pass the
+# watcher schedules every LOG_COMPRESS_INTERVAL seconds. A process' output log is
+# rolled over when the next process for that project starts, once it is larger than
+# OUTPUT_LOG_MAX_BYTES. The limit is not enforced while the process runs, since on
+# Windows the child's open handle prevents renaming and does not append after a truncate.
+LOG_COMPRESS_AGE = 24 * 3600
+LOG_COMPRESS_INTERVAL = 3600
+OUTPUT_LOG_MAX_BYTES = 10 * 1024 * 1024
+_log_executor = ThreadPoolExecutor(max_workers=1)
+
+# A branch_to_watch that is a full commit SHA pins the project to that commit.
+_PINNED_SHA_RE = re.compile(r"[0-9a-f]{40}")
+
+# Opened git.Repo objects per path, see get_repo.
+_repos = {}
+
+# Last remote head seen per (remote url, branch), as (monotonic time, sha).
+# Projects sharing a remote reuse the same answer within a fetch interval.
+_fetch_cache = {}
+
+# Remote head merged by the last successful pull per (working_dir, branch).
+# With local commits the merge leaves HEAD different from the remote head, so
+# comparing against HEAD alone would pull (and restart) on every check.
+_pulled_heads = {}
+
+# Issues are posted by a background worker, repeated failures with the same
+# title are only reported once per ISSUE_DEDUP_PERIOD seconds.
+ISSUE_DEDUP_PERIOD = 3600
+_recent_issues = {}
+_issue_queue = queue.Queue()
+
+# Reused for all GitHub API calls so the TLS connection is kept alive.
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504])))
 
 # --- Functions ---
 
+def get_repo(repo_path):
+    """Returns a cached git.Repo for the given path, opening it on first use."""
+    repo = _repos.get(repo_path)
+    if repo is None:
+        repo = _repos[repo_path] = git.Repo(repo_path)
+    return repo
+
+def group_projects_by_repo(projects):
+    """Groups projects sharing a working tree so each repository is opened and checked once.
+
+    Returns a dict of repo_path -> {"repo_instance": git.Repo, "projects": [...]}.
+    """
+    repos = {}
+    for project in projects:
+        repo_path = project["repo_path"]
+        if repo_path not in repos:
+            repos[repo_path] = {
+                "repo_instance": get_repo(repo_path),
+                "projects": []
+            }
+        repos[repo_path]["projects"].append(project)
+    return repos
+
 def get_latest_commit_hash(repo):
     """Gets the latest commit hash of the local repository."""
     return repo.head.commit.hexsha
 
-def has_new_commit(repo, branch):
-    """Checks if there is a new commit in the remote repository."""
+def is_pinned_commit(branch):
+    """Returns True if branch_to_watch is a full commit SHA rather than a branch name."""
+    return _PINNED_SHA_RE.fullmatch(branch) is not None
+
+def group_by_remote(repo_branches):
+    """Groups (repo, branch) pairs by remote URL.
+
+    Returns a list of (repo, branches) with one entry per remote, ready for
+    refresh_remote_heads. Pinned commits and repos without remotes are left out.
+    """
+    remotes = {}
+    for repo, branch in repo_branches:
+        if is_pinned_commit(branch) or not repo.remotes:
+            continue
+        remotes.setdefault(repo.remotes[0].url, (repo, set()))[1].add(branch)
+    return list(remotes.values())
+
+def refresh_remote_heads(repo, branches):
+    """Queries the heads of several branches in one ls-remote round trip and caches them for has_new_commit.
+
+    Branches missing on the remote are cached as None. Returns False if the query failed.
+    """
+    remote = repo.remotes[0]
+    try:
+        print(f"Querying remote: {remote.url}")
+        # ls-remote only exchanges ref advertisements, no objects are downloaded.
+        # The actual fetch happens in pull_latest_changes when something changed.
+        output = repo.git.ls_remote('--heads', remote.name, *[f"refs/heads/{branch}" for branch in branches], **_REMOTE_QUERY_KWARGS)
+    except git.exc.GitCommandError as e:
+        print(f"Error querying remote: {e}")
+        return False
+    heads = {}
+    for line in output.splitlines():
+        sha, ref = line.split()
+        heads[ref[len("refs/heads/"):]] = sha
+    now = time.monotonic()
+    for branch in branches:
+        _fetch_cache[(remote.url, branch)] = (now, heads.get(branch))
+    return True
+
+def has_new_commit(repo, branch, refresh=True):
+    """Checks if there is a new commit in the remote repository.
+
+    Callers that just ran refresh_remote_heads pass refresh=False, so a failed
+    query is not repeated against the same remote.
+    """
+    if is_pinned_commit(branch):
+        # A commit never moves, only a changed pin needs an update. No network needed.
+        return repo.head.commit.hexsha != branch
     if not repo.remotes:
         print(f"No remotes found in the repository: {repo.working_dir}")
         return False
     try:
         remote = repo.remotes[0]
-        print(f"Fetching from remote: {remote.url}")
-        remote.fetch()
+        key = (remote.url, branch)
+        cached = _fetch_cache.get(key)
+        if not cached or time.monotonic() - cached[0] >= FETCH_INTERVAL * 0.9:
+            # A failed query was already reported by refresh_remote_heads
+            if not refresh or not refresh_remote_heads(repo, [branch]):
+                return False
+            cached = _fetch_cache[key]
+        remote_hash = cached[1]
+        if remote_hash is None:
+            print(f"Branch {branch} not found on remote.")
+            return False
         local_hash = repo.head.commit.hexsha
-        remote_hash = remote.refs[branch].commit.hexsha
-        if local_hash != remote_hash:
+        if local_hash != remote_hash and _pulled_heads.get((repo.working_dir, branch)) != remote_hash:
             print(f"New commit found: {remote_hash}")
             return True
         else:
@@ -94,9 +235,6 @@ def has_new_commit(repo, branch):
     except git.exc.GitCommandError as e:
         print(f"Error fetching remote: {e}")
         return False
-    except IndexError:
-        print(f"Branch {branch} not found on remote.")
-        return False
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         return False
@@ -108,7 +246,18 @@ def pull_latest_changes(repo, project, strategy='theirs'):
         return False
     try:
         remote = repo.remotes[0]
-        remote.pull(strategy_option=strategy)
+        branch = project["branch_to_watch"]
+        if is_pinned_commit(branch):
+            # Pinned projects are moved to the exact commit, there is nothing to merge.
+            remote.fetch(branch, no_tags=True, env=_GIT_LOW_SPEED_ENV)
+            repo.git.checkout(branch)
+        else:
+            if repo.head.is_detached:
+                # Left behind by a pin that has since been removed, go back to the branch before merging.
+                repo.git.checkout(branch)
+            # Only transfer the watched branch, not every branch and tag on the remote.
+            remote.pull(branch, strategy_option=strategy, no_tags=True, env=_GIT_LOW_SPEED_ENV)
+            _pulled_heads[(repo.working_dir, branch)] = repo.commit("FETCH_HEAD").hexsha
         print(f"Successfully pulled latest changes for {project['name']} with strategy {strategy}.")
         return True
     except git.exc.GitCommandError as e:
@@ -116,62 +265,164 @@ def pull_latest_changes(repo, project, strategy='theirs'):
         save_log_and_create_issue(project, "Failed to pull changes", str(e), "")
         return False
 
+def snapshot_processes():
+    """Returns a list of (pid, name, cmdline) tuples for all running processes."""
+    snapshot = []
+    for proc in psutil.process_iter(attrs=['name', 'cmdline']):
+        cmdline = proc.info.get('cmdline') or []
+        snapshot.append((proc.pid, proc.info.get('name') or "", " ".join(cmdline)))
+    return snapshot
+
+@functools.lru_cache(maxsize=None)
+def _match_pattern(*needles):
+    """Returns a compiled regex matching any of the given literal strings."""
+    return re.compile("|".join(map(re.escape, needles)))
+
 def is_process_running(process_name):
     """Checks if a process with the given name is currently running."""
-    for proc in psutil.process_iter(['name', 'cmdline']):
-        cmdline = proc.info.get('cmdline') or []
-        if process_name in proc.info['name'] or process_name in " ".join(cmdline):
-            return True
-    return False
+    search = _match_pattern(process_name).search
+    return any(search(name) or search(cmdline) for _, name, cmdline in snapshot_processes())
 
-def stop_process(project):
-    """Stops the currently running process for a given project."""
+def _add_process_tree(pid, targets):
+    """Adds the process and its children to targets, keyed by PID."""
+    p = psutil.Process(pid)
+    # Include children to prevent orphans
+    for child in p.children(recursive=True):
+        targets[child.pid] = child
+    targets[pid] = p
+
+def stop_process(project, process=None):
+    """Stops the currently running process for a given project.
+
+    If the Popen object returned by start_process is given, its process tree
+    is stopped directly. Otherwise the process table is scanned, which also
+    catches processes started before the watcher.
+    """
     process_name = project["process_name"]
-    script_to_run = project["script_to_run"]
-    for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
+
+    # Collect the matching processes and their children first so they can be
+    # terminated together and waited on in a single batch.
+    targets = {}
+    if process is not None:
         try:
-            cmdline = proc.info.get('cmdline') or []
+            _add_process_tree(process.pid, targets)
+        except psutil.NoSuchProcess:
+            print(f"Process with PID {process.pid} already terminated.")
+        except psutil.AccessDenied:
+            print(f"Access denied to process with PID {process.pid}.")
+    else:
+        search = _match_pattern(process_name, project["script_to_run"]).search
+        for pid, name, cmdline in snapshot_processes():
             # Check if the process name or script to run is in the command line
-            if process_name in " ".join(cmdline) or script_to_run in " ".join(cmdline):
-                print(f"Found process to stop: {proc.info['name']} (PID: {proc.pid}) - {' '.join(cmdline)}")
-                p = psutil.Process(proc.pid)
-                # Terminate children first to prevent orphans
-                for child in p.children(recursive=True):
-                    print(f"Stopping child process (PID: {child.pid})")
-                    child.terminate()
-                p.terminate()
-                p.wait()
-                print(f"Process {process_name} (PID: {proc.pid}) and its children have been terminated.")
+            if not search(cmdline):
+                continue
+            try:
+                print(f"Found process to stop: {name} (PID: {pid}) - {cmdline}")
+                _add_process_tree(pid, targets)
+            except psutil.NoSuchProcess:
+                print(f"Process with PID {pid} already terminated.")
+            except psutil.AccessDenied:
+                print(f"Access denied to process with PID {pid}.")
+            except Exception as e:
+                print(f"An error occurred while trying to stop process {pid}: {e}")
+
+    if not targets:
+        return
+
+    for p in targets.values():
+        try:
+            p.terminate()
         except psutil.NoSuchProcess:
-            print(f"Process with PID {proc.pid} already terminated.")
+            pass
         except psutil.AccessDenied:
-            print(f"Access denied to process with PID {proc.pid}.")
-        except Exception as e:
-            print(f"An error occurred while trying to stop process {proc.pid}: {e}")
+            print(f"Access denied to process with PID {p.pid}.")
+
+    gone, alive = psutil.wait_procs(targets.values(), timeout=5, callback=lambda p: print(f"Process (PID: {p.pid}) has been terminated."))
+    if alive:
+        for p in alive:
+            print(f"Process (PID: {p.pid}) did not terminate in time, killing it.")
+            try:
+                p.kill()
+            except psutil.NoSuchProcess:
+                pass
+            except psutil.AccessDenied:
+                print(f"Access denied to process with PID {p.pid}.")
+        psutil.wait_procs(alive, timeout=2)
+    print(f"Process {process_name} and its children have been stopped.")
 
 def start_process(project):
-    """Starts the specified script and returns the process object."""
+    """Starts the specified script and returns the process object.
+
+    The script's stdout and stderr are appended to LOG_DIR/<name>.out.log
+    instead of a pipe, so long-running children cannot fill the pipe buffer
+    and nothing is held in the watcher's memory. Use read_process_output to
+    get what the process wrote.
+    """
     script_path = os.path.join(project["repo_path"], project["script_to_run"])
+    cwd = None
+    if project.get("exec_argv"):
+        # Run the real command directly, saving the shell fork and making the
+        # Popen PID the process itself.
+        command = list(project["exec_argv"])
+        cwd = project["repo_path"]
+    elif os.name == 'nt':
+        command = [script_path]
+    else:
+        command = ["bash", script_path]
+    output_log_path = os.path.join(LOG_DIR, f"{project['name']}.out.log")
+    try:
+        if os.path.getsize(output_log_path) > OUTPUT_LOG_MAX_BYTES:
+            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            os.replace(output_log_path, os.path.join(LOG_DIR, f"{project['name']}.out_{timestamp}.log"))
+    except OSError:
+        pass # No log yet, or still held open by a previous run on Windows
     try:
-        if os.name == 'nt': # Windows
-            if AUTOWATCH_ENV == "dev":
-                process = subprocess.Popen(["cmd", "/k", script_path], creationflags=subprocess.CREATE_NEW_CONSOLE)
-            else:
-                process = subprocess.Popen([script_path], creationflags=subprocess.CREATE_NO_WINDOW, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        else: # Linux/macOS
-            process = subprocess.Popen(["bash", script_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        with open(output_log_path, "ab") as output_log:
+            output_log.seek(0, os.SEEK_END)
+            output_log_offset = output_log.tell()
+            output_log_stat = os.fstat(output_log.fileno())
+            if os.name == 'nt': # Windows
+                if AUTOWATCH_ENV == "dev":
+                    process = subprocess.Popen(["cmd", "/k"] + command, cwd=cwd, creationflags=subprocess.CREATE_NEW_CONSOLE)
+                else:
+                    process = subprocess.Popen(command, cwd=cwd, creationflags=subprocess.CREATE_NO_WINDOW, stdout=output_log, stderr=subprocess.STDOUT)
+            else: # Linux/macOS
+                process = subprocess.Popen(command, cwd=cwd, stdout=output_log, stderr=subprocess.STDOUT)
+        process.output_log_path = output_log_path
+        process.output_log_offset = output_log_offset
+        process.output_log_id = (output_log_stat.st_dev, output_log_stat.st_ino)
         print(f"Successfully started script for {project['name']}.")
         return process
     except Exception as e:
         print(f"Error starting script for {project['name']}: {e}")
         return None
 
-def create_github_issue(project, title, body):
-    """Creates a new issue on GitHub."""
-    if not GITHUB_TOKEN:
-        print("GITHUB_TOKEN environment variable not set. Cannot create issue.")
-        return
+def read_process_output(process, max_bytes=OUTPUT_TAIL_BYTES):
+    """Returns the last max_bytes of output written by a process from start_process.
 
+    Only the tail is read, so the cost does not depend on how much the
+    process wrote over its lifetime. A truncated tail starts at a line boundary.
+    If a later start_process rolled the log over first, the output is left in
+    the rolled <name>.out_<timestamp>.log and only a note is returned.
+    """
+    try:
+        with open(process.output_log_path, "rb") as output_log:
+            output_log_stat = os.fstat(output_log.fileno())
+            end = output_log.seek(0, os.SEEK_END)
+            if (output_log_stat.st_dev, output_log_stat.st_ino) != process.output_log_id or end < process.output_log_offset:
+                print(f"Output log {process.output_log_path} was rolled over since the process started.")
+                return f"Output log was rolled over, see {process.output_log_path[:-len('.out.log')]}.out_*.log\n"
+            start = max(process.output_log_offset, end - max_bytes)
+            output_log.seek(start)
+            if start > process.output_log_offset:
+                output_log.readline() # Drop the partial first line
+            return output_log.read().decode("utf-8", errors="replace")
+    except OSError as e:
+        print(f"Error reading output log {process.output_log_path}: {e}")
+        return ""
+
+def _post_github_issue(project, title, body):
+    """Posts a new issue on GitHub."""
     url = f"https://api.github.com/repos/{project['github_repo']}/issues"
     headers = {
         "Authorization": f"token {GITHUB_TOKEN}",
@@ -179,7 +430,7 @@ def create_github_issue(project, title, body):
     }
     data = {"title": title, "body": body, "labels": ["bug"]}
     try:
-        response = requests.post(url, headers=headers, json=data)
+        response = _session.post(url, headers=headers, json=data, timeout=(3, 10))
         if response.status_code == 201:
             print(f"Successfully created GitHub issue for {project['name']}.")
         else:
@@ -187,15 +438,79 @@ def create_github_issue(project, title, body):
     except requests.exceptions.RequestException as e:
         print(f"Error creating GitHub issue for {project['name']}: {e}")
 
+def _issue_worker():
+    """Posts queued issues in the background so the watcher never waits on GitHub."""
+    while True:
+        project, title, body = _issue_queue.get()
+        _post_github_issue(project, title, body)
+
+def create_github_issue(project, title, body):
+    """Queues a new issue on GitHub, skipping repeats of the same title within ISSUE_DEDUP_PERIOD."""
+    if not GITHUB_TOKEN:
+        print("GITHUB_TOKEN environment variable not set. Cannot create issue.")
+        return
+
+    key = (project['github_repo'], hashlib.blake2b(title.encode(), digest_size=8).hexdigest())
+    now = time.monotonic()
+    last_created = _recent_issues.get(key)
+    if last_created is not None and now - last_created < ISSUE_DEDUP_PERIOD:
+        print(f"Skipping duplicate GitHub issue for {project['name']}: {title}")
+        return
+    _recent_issues[key] = now
+    _issue_queue.put((project, title, body))
+
+def _compress_log(path):
+    """Replaces the log file with a gzipped copy."""
+    with open(path, "rb") as src, gzip.open(path + ".gz", "wb", compresslevel=1) as dst:
+        shutil.copyfileobj(src, dst)
+    os.unlink(path)
+
+def compress_old_logs():
+    """Gzips logs in LOG_DIR not modified for LOG_COMPRESS_AGE seconds.
+
+    The live output logs of running processes (<name>.out.log) are skipped.
+    """
+    cutoff = time.time() - LOG_COMPRESS_AGE
+    with os.scandir(LOG_DIR) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".log") or entry.name.endswith(".out.log"):
+                continue
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    _compress_log(entry.path)
+            except OSError as e:
+                print(f"Error compressing log {entry.name}: {e}")
+
+def schedule_log_compression():
+    """Runs compress_old_logs on the log executor, off the caller's thread."""
+    _log_executor.submit(compress_old_logs)
+
 def save_log_and_create_issue(project, title, stdout, stderr):
     """Saves the log to a file and creates a GitHub issue."""
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     log_filename = f"{project['name']}_{timestamp}.log"
     log_filepath = os.path.join(LOG_DIR, log_filename)
 
-    with open(log_filepath, "w") as f:
+    with open(log_filepath, "w", encoding="utf-8") as f:
         f.write(f"--- STDOUT ---\n{stdout}\n")
         f.write(f"--- STDERR ---\n{stderr}\n")
 
+    stdout, stderr = stdout[-ISSUE_OUTPUT_CHARS:], stderr[-ISSUE_OUTPUT_CHARS:]
     body = f"Error starting script for {project['name']}.\n\nLog file: `{log_filename}`\n\n--- STDOUT ---\n```\n{stdout}```\n\n--- STDERR ---\n```\n{stderr}```"
     create_github_issue(project, title, body)
+
+def _report_process_failure(project, title, process):
+    try:
+        save_log_and_create_issue(project, title, read_process_output(process), "")
+    except Exception as e:
+        print(f"Error reporting failure for {project['name']}: {e}")
+
+def report_process_failure(project, title, process):
+    """Saves the output of a failed process from start_process and creates an issue, in the background.
+
+    The log is read and written on the log executor, the issue is then posted
+    by the issue worker, so the caller never waits on the disk or on GitHub.
+    """
+    _log_executor.submit(_report_process_failure, project, title, process)
+
+threading.Thread(target=_issue_worker, daemon=True).start()
@@ -1,11 +1,64 @@
 import sys
-import datetime
+import functools
+import queue
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from PyQt5.QtWidgets import QApplication, QWidget, QLabel, QGridLayout
-from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtCore import QEvent, QThread, pyqtSignal
 
 import autowatch
 
+# Shared by all fetch cycles, remote queries are network bound so threads overlap them
+_FETCH_POOL = ThreadPoolExecutor(max_workers=min(8, len(autowatch.PROJECTS)))
+
+# Status texts shown in the GUI, shared instead of rebuilt on every pass
+STATUS_STARTING = "Starting..."
+STATUS_WATCHING = "Watching"
+STATUS_RESTARTING = "Restarting Script"
+STATUS_ERROR_PULLING = "Error Pulling"
+SCRIPT_STARTUP_FAILURE = "Startup Failure"
+SCRIPT_CRASHED_WAITING = "Crashed. Waiting to retry..."
+SCRIPT_STOPPED_WAITING = "Stopped. Waiting to retry..."
+SCRIPT_MAX_RETRIES = "Failed to start. Max retries reached."
+SCRIPT_STOPPED = "Stopped"
+SCRIPT_RUNNING = "Running"
+SCRIPT_STARTING_UP = "Starting up..."
+
+@functools.lru_cache(maxsize=64)
+def _crashed_retrying(attempt, max_retries):
+    return f"Crashed. Retrying ({attempt}/{max_retries})"
+
+@functools.lru_cache(maxsize=64)
+def _stopped_retrying(attempt, max_retries):
+    return f"Stopped. Retrying ({attempt}/{max_retries})"
+
+class ProjectState:
+    """Supervision state of one project, owned by the watcher thread.
+
+    The project's fixed settings are resolved once here instead of looked up on every pass.
+    """
+    __slots__ = (
+        "project", "name", "max_retries", "retry_delay", "startup_period",
+        "retry_count", "last_retry_time", "process", "status", "script_status", "start_time", "last_emitted",
+    )
+
+    def __init__(self, project):
+        self.project = project
+        self.name = project["name"]
+        self.max_retries = project["max_retries"]
+        self.retry_delay = project["retry_delay"]
+        self.startup_period = project["startup_period"]
+        # Timestamps are time.monotonic() values, -inf means "never"
+        self.retry_count = 0
+        self.last_retry_time = float("-inf")
+        self.process = None
+        self.status = STATUS_STARTING
+        self.script_status = STATUS_STARTING
+        self.start_time = 0
+        # (status, script_status) last sent to the GUI
+        self.last_emitted = None
+
 class WatcherThread(QThread):
     """Runs the autowatch logic in a separate thread."""
     project_status_changed = pyqtSignal(str, str, str)
@@ -13,156 +66,265 @@ class WatcherThread(QThread):
 
     def __init__(self):
         super().__init__()
-        self.project_states = {
-            project["name"]: {
-                "retry_count": 0, 
-                "last_retry_time": 0, 
-                "process": None, 
-                "status": "Starting...", 
-                "script_status": "Starting...",
-                "start_time": 0,
-                "last_fetch_time": 0,
-            }
-            for project in autowatch.PROJECTS
-        }
+        self.project_states = {project["name"]: ProjectState(project) for project in autowatch.PROJECTS}
+        # Woken up by process exits and finished remote checks, see _start_process and _submit_checks
+        self._events = queue.Queue()
+        # Remote checks and pulls running on _FETCH_POOL
+        self._pending_checks = []
+        self._pending_pulls = []
+        # repo_path -> repo_data, filled in by run()
+        self._repos = {}
+        # Next time.monotonic() at which old logs are compressed
+        self._next_log_compression = float("-inf")
+        # States of the projects the watcher supervises (all but itself)
+        self._plan = [state for name, state in self.project_states.items() if name != "autowatcher_vale"]
+
+    def _start_process(self, project):
+        """Starts the project's script and arranges for its exit to wake the watcher loop."""
+        state = self.project_states[project["name"]]
+        process = autowatch.start_process(project)
+        state.process = process
+        state.start_time = time.monotonic()
+        # A restarted project may be waiting on a fix, check its repo at the base rate again
+        self._repos[project["repo_path"]]["fetch_interval"] = autowatch.FETCH_INTERVAL
+        if process:
+            threading.Thread(target=self._wait_for_exit, args=(project["name"], process), daemon=True).start()
+        return process
+
+    def _emit_status(self, project_name, state):
+        """Emits project_status_changed only if the status changed since the last emit."""
+        current = (state.status, state.script_status)
+        if current != state.last_emitted:
+            state.last_emitted = current
+            self.project_status_changed.emit(project_name, *current)
+
+    def _check_remote(self, repo_paths):
+        """Runs on _FETCH_POOL: queries a remote once and checks each repo using it for new commits."""
+        repo_branches = [(self._repos[path]["repo_instance"], self._repos[path]["projects"][0]["branch_to_watch"]) for path in repo_paths]
+        for repo, branches in autowatch.group_by_remote(repo_branches):
+            autowatch.refresh_remote_heads(repo, branches)
+        return {path: autowatch.has_new_commit(repo, branch, refresh=False) for path, (repo, branch) in zip(repo_paths, repo_branches)}
+
+    def _submit_checks(self, repo_paths):
+        """Starts remote checks in the background, one job per remote. Completion wakes the loop."""
+        by_remote = {}
+        for repo_path in repo_paths:
+            repo = self._repos[repo_path]["repo_instance"]
+            by_remote.setdefault(repo.remotes[0].url if repo.remotes else repo_path, []).append(repo_path)
+        for paths in by_remote.values():
+            for repo_path in paths:
+                self._repos[repo_path]["busy"] = True
+            future = _FETCH_POOL.submit(self._check_remote, paths)
+            future.add_done_callback(lambda f: self._events.put(None))
+            self._pending_checks.append((paths, future))
+
+    def _collect_checks(self):
+        """Returns {repo_path: has_new_commit} for the remote checks that have finished."""
+        results = {}
+        still_pending = []
+        for paths, future in self._pending_checks:
+            if not future.done():
+                still_pending.append((paths, future))
+                continue
+            for repo_path in paths:
+                self._repos[repo_path]["busy"] = False
+            if future.exception():
+                print(f"Error checking for new commits: {future.exception()}")
+            else:
+                results.update(future.result())
+        self._pending_checks = still_pending
+        return results
+
+    def _submit_pull(self, repo_path):
+        """Starts pulling a repo with a new commit in the background. Completion wakes the loop."""
+        repo_data = self._repos[repo_path]
+        repo_data["busy"] = True
+        future = _FETCH_POOL.submit(autowatch.pull_latest_changes, repo_data["repo_instance"], repo_data["projects"][0], strategy='theirs')
+        future.add_done_callback(lambda f: self._events.put(None))
+        self._pending_pulls.append((repo_path, future))
+
+    def _collect_pulls(self):
+        """Returns {repo_path: pulled} for the pulls that have finished."""
+        results = {}
+        still_pending = []
+        for repo_path, future in self._pending_pulls:
+            if not future.done():
+                still_pending.append((repo_path, future))
+                continue
+            self._repos[repo_path]["busy"] = False
+            if future.exception():
+                print(f"Error pulling changes: {future.exception()}")
+                results[repo_path] = False
+            else:
+                results[repo_path] = future.result()
+        self._pending_pulls = still_pending
+        return results
+
+    def _wait_for_exit(self, project_name, process):
+        # wait() sets process.returncode, so the loop can read it instead of
+        # calling poll() (a waitpid syscall) for every project on every pass
+        process.wait()
+        self._events.put(project_name)
+
+    def _next_wakeup(self, repos):
+        """Returns the seconds until the next fetch, startup period end, retry or log compression is due."""
+        current_time = time.monotonic()
+        deadlines = [self._next_log_compression]
+        for repo_data in repos.values():
+            # A busy repo is not resubmitted, the completion of its check or pull wakes the loop instead
+            if not repo_data["busy"]:
+                deadlines.append(repo_data["last_fetch_time"] + repo_data["fetch_interval"])
+        for state in self._plan:
+            process = state.process
+            startup_end = state.start_time + state.startup_period
+            if process and current_time < startup_end:
+                # Either becomes "Running" or, if it already died, a retryable crash
+                deadlines.append(startup_end)
+            elif state.retry_count < state.max_retries and (not process or process.returncode not in (None, 0)):
+                deadlines.append(state.last_retry_time + state.retry_delay)
+        # Wake slightly past the deadline, the checks use strict comparisons
+        return max(min(deadlines) - current_time, 0) + 0.1
+
+    def _wait_for_events(self, timeout):
+        """Blocks until a supervised process exits, a remote check finishes or the timeout expires."""
+        try:
+            self._events.get(timeout=timeout)
+            while True:
+                self._events.get_nowait()
+        except queue.Empty:
+            pass
 
     def run(self):
         """The main logic of the watcher thread."""
         # Group projects by repo_path
-        repos = {}
-        for project in autowatch.PROJECTS:
-            repo_path = project["repo_path"]
-            if repo_path not in repos:
-                repos[repo_path] = {
-                    "repo_instance": autowatch.git.Repo(repo_path),
-                    "projects": []
-                }
-            repos[repo_path]["projects"].append(project)
-
-        # Initial start of all processes
-        for repo_path, repo_data in repos.items():
-            for project in repo_data["projects"]:
-                # Don't start the autowatcher itself, the launcher does that
-                if project["name"] == "autowatcher_vale":
-                    continue
-                process = autowatch.start_process(project)
-                self.project_states[project["name"]]["process"] = process
-                self.project_states[project["name"]]["start_time"] = time.time()
+        repos = self._repos = autowatch.group_projects_by_repo(autowatch.PROJECTS)
+        for repo_data in repos.values():
+            repo_data["fetch_interval"] = autowatch.FETCH_INTERVAL
+            repo_data["last_fetch_time"] = float("-inf")
+            # True while a remote check or pull for the repo runs on _FETCH_POOL
+            repo_data["busy"] = False
+
+        # Initial start of all processes, the launcher starts the autowatcher itself
+        for state in self._plan:
+            self._start_process(state.project)
 
         while True:
+            # One clock read per pass, all of these are interval checks
+            now = time.monotonic()
+            due_repos = []
             for repo_path, repo_data in repos.items():
-                repo_instance = repo_data["repo_instance"]
-                
-                # Check for new commits for the repo
-                project_for_branch_check = repo_data["projects"][0]
-                current_time = time.time()
-
-                first_project_name = project_for_branch_check["name"]
-                if current_time - self.project_states[first_project_name]["last_fetch_time"] > autowatch.FETCH_INTERVAL:
-                    self.project_states[first_project_name]["last_fetch_time"] = current_time
-                    
-                    if autowatch.has_new_commit(repo_instance, project_for_branch_check["branch_to_watch"]):
-                        if autowatch.pull_latest_changes(repo_instance, project_for_branch_check, strategy='theirs'):
-                            # If new commit is found, pull changes and restart all projects in this repo
-                            for project in repo_data["projects"]:
-                                if project["name"] == "autowatcher_vale":
-                                    # If the updated project is the autowatcher, first stop all other processes
-                                    print("Self-update detected. Stopping all monitored processes before restarting...")
-                                    for p in autowatch.PROJECTS:
-                                        if p["name"] != "autowatcher_vale":
-                                            state = self.project_states[p["name"]]
-                                            if state["process"] and state["process"].poll() is None:
-                                                autowatch.stop_process(p)
-                                    
-                                    # Now, emit the restart signal
-                                    self.restart_required.emit()
-                                    time.sleep(1)
-                                    return
-                                else:
-                                    # For other projects, restart the script
-                                    state = self.project_states[project["name"]]
-                                    state["status"] = "Restarting Script"
-                                    self.project_status_changed.emit(project["name"], state["status"], state["script_status"])
-                                    
-                                    if state["process"] and state["process"].poll() is None:
-                                        autowatch.stop_process(project)
-                                    
-                                    process = autowatch.start_process(project)
-                                    state["process"] = process
-                                    state["retry_count"] = 0
-                                    state["start_time"] = time.time()
+                if not repo_data["busy"] and now - repo_data["last_fetch_time"] > repo_data["fetch_interval"]:
+                    repo_data["last_fetch_time"] = now
+                    due_repos.append(repo_path)
+
+            if now >= self._next_log_compression:
+                autowatch.schedule_log_compression()
+                self._next_log_compression = now + autowatch.LOG_COMPRESS_INTERVAL
+
+            # Remote checks and pulls run in the background so a slow remote never
+            # delays handling a process exit, their results arrive on a later pass
+            self._submit_checks(due_repos)
+            new_commits = self._collect_checks()
+
+            for repo_path, has_new_commit in new_commits.items():
+                repo_data = repos[repo_path]
+                # Back off on quiet repos, go back to the base rate as soon as something lands
+                if has_new_commit:
+                    repo_data["fetch_interval"] = autowatch.FETCH_INTERVAL
+                    self._submit_pull(repo_path)
+                else:
+                    repo_data["fetch_interval"] = min(repo_data["fetch_interval"] * 2, autowatch.FETCH_INTERVAL * autowatch.MAX_FETCH_INTERVAL_FACTOR)
+                    for project in repo_data["projects"]:
+                        self.project_states[project["name"]].status = STATUS_WATCHING
+
+            for repo_path, pulled in self._collect_pulls().items():
+                repo_data = repos[repo_path]
+                if pulled:
+                    # Changes were pulled, restart all projects in this repo
+                    for project in repo_data["projects"]:
+                        if project["name"] == "autowatcher_vale":
+                            # If the updated project is the autowatcher, first stop all other processes
+                            print("Self-update detected. Stopping all monitored processes before restarting...")
+                            for state in self._plan:
+                                if state.process and state.process.returncode is None:
+                                    autowatch.stop_process(state.project, process=state.process)
+                            
+                            # Now, emit the restart signal
+                            self.restart_required.emit()
+                            time.sleep(1)
+                            return
                         else:
-                            for project in repo_data["projects"]:
-                                self.project_states[project["name"]]["status"] = "Error Pulling"
-                    else:
-                        for project in repo_data["projects"]:
-                            self.project_states[project["name"]]["status"] = "Watching"
+                            # For other projects, restart the script
+                            state = self.project_states[project["name"]]
+                            state.status = STATUS_RESTARTING
+                            self._emit_status(project["name"], state)
+                            
+                            if state.process and state.process.returncode is None:
+                                autowatch.stop_process(project, process=state.process)
+                            
+                            self._start_process(project)
+                            state.retry_count = 0
+                else:
+                    for project in repo_data["projects"]:
+                        self.project_states[project["name"]].status = STATUS_ERROR_PULLING
 
             # Process status checks
-            for project in autowatch.PROJECTS:
-                if project["name"] == "autowatcher_vale":
-                    continue # Don't check status for the autowatcher itself
-
-                project_name = project["name"]
-                state = self.project_states[project_name]
+            emit_status = self._emit_status
+            for state in self._plan:
+                project, project_name = state.project, state.name
+                max_retries, retry_delay = state.max_retries, state.retry_delay
+                process = state.process
+                retry_count = state.retry_count
 
                 # Check process status (same as before)
-                if state["process"] and state["process"].poll() is not None:
-                    is_startup_failure = time.time() - state["start_time"] < project["startup_period"]
+                if process and process.returncode is not None:
+                    is_startup_failure = now - state.start_time < state.startup_period
                     
                     if is_startup_failure:
-                        if state["script_status"] != "Startup Failure":
-                            state["script_status"] = "Startup Failure"
-                            stdout, stderr = state["process"].communicate()
-                            print(f"Process {project_name} failed during startup. stdout: {stdout}, stderr: {stderr}")
-                            autowatch.save_log_and_create_issue(project, f"Startup Failure: {project_name}", stdout, stderr)
-                    elif state["process"].returncode != 0:
-                        if state["retry_count"] < project["max_retries"]:
-                            current_time = time.time()
-                            if current_time - state["last_retry_time"] > project["retry_delay"]:
-                                state["script_status"] = f"Crashed. Retrying ({state['retry_count'] + 1}/{project['max_retries']})"
+                        if state.script_status != SCRIPT_STARTUP_FAILURE:
+                            state.script_status = SCRIPT_STARTUP_FAILURE
+                            print(f"Process {project_name} failed during startup.")
+                            autowatch.report_process_failure(project, f"Startup Failure: {project_name}", process)
+                    elif process.returncode != 0:
+                        if retry_count < max_retries:
+                            if now - state.last_retry_time > retry_delay:
+                                state.script_status = _crashed_retrying(retry_count + 1, max_retries)
                                 print(f"Process {project_name} crashed. Retrying...")
-                                process = autowatch.start_process(project)
-                                state["process"] = process
-                                state["retry_count"] += 1
-                                state["last_retry_time"] = time.time()
-                                state["start_time"] = time.time()
+                                self._start_process(project)
+                                state.retry_count = retry_count + 1
+                                state.last_retry_time = now
                             else:
-                                state["script_status"] = f"Crashed. Waiting to retry..."
+                                state.script_status = SCRIPT_CRASHED_WAITING
                         else:
-                            if state["script_status"] != "Failed to start. Max retries reached.":
-                                state["script_status"] = "Failed to start. Max retries reached."
+                            if state.script_status != SCRIPT_MAX_RETRIES:
+                                state.script_status = SCRIPT_MAX_RETRIES
                                 print(f"Process {project_name} reached max retries.")
-                                stdout, stderr = state["process"].communicate()
-                                autowatch.save_log_and_create_issue(project, f"Crash after retries: {project_name}", stdout, stderr)
+                                autowatch.report_process_failure(project, f"Crash after retries: {project_name}", process)
                     else:
-                        state["script_status"] = "Stopped"
-                        state["process"] = None
-                elif state["process"] and time.time() - state["start_time"] > project["startup_period"]:
-                    state["script_status"] = "Running"
-                    state["retry_count"] = 0
-                elif state["process"]:
-                    state["script_status"] = "Starting up..."
-                elif not state["process"] and state["retry_count"] < project["max_retries"]:
-                    current_time = time.time()
-                    if current_time - state["last_retry_time"] > project["retry_delay"]:
-                        state["script_status"] = f"Stopped. Retrying ({state['retry_count'] + 1}/{project['max_retries']})"
+                        state.script_status = SCRIPT_STOPPED
+                        state.process = None
+                elif process and now - state.start_time > state.startup_period:
+                    state.script_status = SCRIPT_RUNNING
+                    state.retry_count = 0
+                elif process:
+                    state.script_status = SCRIPT_STARTING_UP
+                elif retry_count < max_retries:
+                    if now - state.last_retry_time > retry_delay:
+                        state.script_status = _stopped_retrying(retry_count + 1, max_retries)
                         print(f"Process {project_name} is not running. Retrying...")
-                        process = autowatch.start_process(project)
-                        state["process"] = process
-                        state["retry_count"] += 1
-                        state["last_retry_time"] = time.time()
-                        state["start_time"] = time.time()
+                        self._start_process(project)
+                        state.retry_count = retry_count + 1
+                        state.last_retry_time = now
                     else:
-                        state["script_status"] = f"Stopped. Waiting to retry..."
-                elif not state["process"]:
-                     if state["script_status"] != "Failed to start. Max retries reached.":
-                        state["script_status"] = "Failed to start. Max retries reached."
-                        print(f"Process {project_name} is not running and max retries reached.")
+                        state.script_status = SCRIPT_STOPPED_WAITING
+                elif state.script_status != SCRIPT_MAX_RETRIES:
+                    state.script_status = SCRIPT_MAX_RETRIES
+                    print(f"Process {project_name} is not running and max retries reached.")
 
-                self.project_status_changed.emit(project_name, state["status"], state["script_status"])
+                emit_status(project_name, state)
 
-            self.msleep(5000)
+            # Sleep until a process exits or something time based is due
+            self._wait_for_events(self._next_wakeup(repos))
 
 class App(QWidget):
     """The main application GUI."""
@@ -170,13 +332,48 @@ class App(QWidget):
         super().__init__()
         self.title = 'AutoWatch Status - Beta'
         self.project_widgets = {}
+        # Formatted "Last Update" text, reused for all updates within the same second
+        self._last_update_sec = None
+        self._last_update_text = ""
+        # Latest (status, script_status, last update text) per project received while hidden
+        self._pending = {}
         self.initUI()
 
+    def _last_update(self):
+        sec = int(time.time())
+        if sec != self._last_update_sec:
+            self._last_update_sec = sec
+            self._last_update_text = f"Last Update: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(sec))}"
+        return self._last_update_text
+
     def set_project_status(self, project_name, status, script_status):
-        if project_name in self.project_widgets:
-            self.project_widgets[project_name]["status_label"].setText(f"Status: {status}")
-            self.project_widgets[project_name]["script_status_label"].setText(f"Script Status: {script_status}")
-            self.project_widgets[project_name]["last_update_label"].setText(f"Last Update: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        if project_name not in self.project_widgets:
+            return
+        if not self.isVisible() or self.isMinimized():
+            # Nobody can see the labels, apply the latest status once the window is shown again
+            self._pending[project_name] = (status, script_status, self._last_update())
+            return
+        self._show_project_status(project_name, status, script_status, self._last_update())
+
+    def _show_project_status(self, project_name, status, script_status, last_update):
+        widgets = self.project_widgets[project_name]
+        widgets["status_label"].setText(f"Status: {status}")
+        widgets["script_status_label"].setText(f"Script Status: {script_status}")
+        widgets["last_update_label"].setText(last_update)
+
+    def _show_pending(self):
+        for project_name, pending in self._pending.items():
+            self._show_project_status(project_name, *pending)
+        self._pending.clear()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self._show_pending()
+
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() == QEvent.WindowStateChange and not self.isMinimized():
+            self._show_pending()
 
     def handle_restart(self):
         print("Restart signal received. Exiting with code 10.")